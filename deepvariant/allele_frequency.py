@@ -136,10 +136,13 @@ def update_haplotype(variant, reference_haplotype, reference_offset):
   offset_start = variant.start - reference_offset
   offset_suffix = \
       variant.start + len(variant.reference_bases) - reference_offset
+  # The reference bases flanking the variant are shared by all ALT alleles, so
+  # slice them out once rather than once per allele.
+  prefix = reference_haplotype[:offset_start]
+  suffix = reference_haplotype[offset_suffix:]
   list_updated_haplotype = []
   for biallelic_variant in variant.alternate_bases:
-    updated_haplotype = reference_haplotype[: offset_start] + \
-        biallelic_variant + reference_haplotype[offset_suffix: ]
+    updated_haplotype = prefix + biallelic_variant + suffix
     dict_haplotype = {
         'haplotype': updated_haplotype,
         'alt': biallelic_variant,
@@ -175,26 +178,30 @@ def match_candidate_and_cohort_haplotypes(candidate_haps,
     A dict with candidate alt alleles as keys, and associated frequencies
     as values.
   """
+  # Group cohort haplotypes by sequence, keeping their original order, so that
+  # exact matches are found with one dict lookup per candidate haplotype.
+  cohort_haps_by_haplotype = collections.defaultdict(list)
+  for cohort_obj in cohort_haps_and_freqs:
+    cohort_haps_by_haplotype[cohort_obj['haplotype']].append(cohort_obj)
+
   dict_allele_frequency = {}
   for candidate_obj in candidate_haps:
     candidate_haplotype = candidate_obj['haplotype']
     candidate_alt = candidate_obj['alt']
     candidate_variant = candidate_obj['variant']
 
-    for cohort_obj in cohort_haps_and_freqs:
-      cohort_haplotype = cohort_obj['haplotype']
-      # Exact haplotype match.
-      if candidate_haplotype == cohort_haplotype:
-        cohort_variant = cohort_obj['variant']
-        cohort_frequency = get_allele_frequency(
-            cohort_variant,
-            list(cohort_variant.alternate_bases).index(cohort_obj['alt']))
-        dict_allele_frequency[candidate_alt] = cohort_frequency
-
-        # Update REF frequency if it is not in the dictionary.
-        if not dict_allele_frequency.get(candidate_variant.reference_bases):
-          dict_allele_frequency[candidate_variant.reference_bases] = \
-              get_ref_allele_frequency(cohort_variant)
+    # Exact haplotype matches.
+    for cohort_obj in cohort_haps_by_haplotype.get(candidate_haplotype, ()):
+      cohort_variant = cohort_obj['variant']
+      cohort_frequency = get_allele_frequency(
+          cohort_variant,
+          list(cohort_variant.alternate_bases).index(cohort_obj['alt']))
+      dict_allele_frequency[candidate_alt] = cohort_frequency
+
+      # Update REF frequency if it is not in the dictionary.
+      if not dict_allele_frequency.get(candidate_variant.reference_bases):
+        dict_allele_frequency[candidate_variant.reference_bases] = \
+            get_ref_allele_frequency(cohort_variant)
 
     # For an unmatched alt allele, set the frequency to 0.
     if not dict_allele_frequency.get(candidate_alt):
@@ -30,6 +30,7 @@
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import numpy as np
 
 from third_party.nucleus.io import fasta
 from third_party.nucleus.io import vcf
@@ -45,6 +46,28 @@ def setUpModule():
 
 class AlleleFrequencyTest(parameterized.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    super(AlleleFrequencyTest, cls).setUpClass()
+    cls.ref_reader = fasta.IndexedFastaReader(testdata.GRCH38_FASTA)
+    cls.vcf_reader = vcf.VcfReader(testdata.VCF_WITH_ALLELE_FREQUENCIES)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.ref_reader.__exit__(None, None, None)
+    cls.vcf_reader.__exit__(None, None, None)
+    super(AlleleFrequencyTest, cls).tearDownClass()
+
+  def _assert_freq_dict_allclose(self, actual, expected, msg=''):
+    """Checks allele frequency dicts match to assertAlmostEqual precision."""
+    keys = sorted(expected)
+    self.assertEqual(sorted(actual), keys, msg=msg)
+    np.testing.assert_allclose([actual[k] for k in keys],
+                               [expected[k] for k in keys],
+                               rtol=0,
+                               atol=5e-8,
+                               err_msg=msg)
+
   @parameterized.parameters(
       # A SNP.
       dict(
@@ -196,9 +219,8 @@ class AlleleFrequencyTest(parameterized.TestCase):
   def test_get_ref_haplotype_and_offset(self, dv_variant, cohort_variants,
                                         expected_ref_haplotype,
                                         expected_ref_offset):
-    ref_reader = fasta.IndexedFastaReader(testdata.GRCH38_FASTA)
     ref_haplotype, ref_offset = allele_frequency.get_ref_haplotype_and_offset(
-        dv_variant, cohort_variants, ref_reader)
+        dv_variant, cohort_variants, self.ref_reader)
     self.assertEqual(ref_haplotype, expected_ref_haplotype)
     self.assertEqual(ref_offset, expected_ref_offset)
 
@@ -370,17 +392,10 @@ class AlleleFrequencyTest(parameterized.TestCase):
           label='matched_snp_2'))
   def test_find_matching_allele_frequency(self, variant, expected_return,
                                           label):
-    ref_reader = fasta.IndexedFastaReader(testdata.GRCH38_FASTA)
-    vcf_reader = vcf.VcfReader(testdata.VCF_WITH_ALLELE_FREQUENCIES)
     allele_frequencies = allele_frequency.find_matching_allele_frequency(
-        variant, vcf_reader, ref_reader)
-    # Compare keys.
-    self.assertSetEqual(
-        set(allele_frequencies.keys()), set(expected_return.keys()), msg=label)
-    # Compare values (almost equal).
-    for key in allele_frequencies.keys():
-      self.assertAlmostEqual(
-          allele_frequencies[key], expected_return[key], msg=label)
+        variant, self.vcf_reader, self.ref_reader)
+    self._assert_freq_dict_allclose(
+        allele_frequencies, expected_return, msg=label)
 
   def test_make_population_vcf_readers_with_multiple_vcfs(self):
     filenames = [testdata.AF_VCF_CHR20, testdata.AF_VCF_CHR21]
@@ -449,23 +464,18 @@ class AlleleFrequencyTest(parameterized.TestCase):
   def test_add_allele_frequencies_to_candidates(self, dv_calls, expected_return,
                                                 testcase):
     if testcase == 'valid':
-      pop_vcf_reader = vcf.VcfReader(testdata.VCF_WITH_ALLELE_FREQUENCIES)
-      ref_reader = fasta.IndexedFastaReader(testdata.GRCH38_FASTA)
+      pop_vcf_reader = self.vcf_reader
+      ref_reader = self.ref_reader
     elif testcase == 'no VCF':
       pop_vcf_reader = None
       ref_reader = None
     else:
       raise ValueError('Invalid testcase for parameterized test.')
-    updated_dv_call = list(
+    updated_dv_call = next(
         allele_frequency.add_allele_frequencies_to_candidates(
             dv_calls, pop_vcf_reader, ref_reader))
-    actual_frequency = updated_dv_call[0].allele_frequency
-    # Compare keys.
-    self.assertSetEqual(
-        set(actual_frequency.keys()), set(expected_return.keys()))
-    # Compare values (almost equal).
-    for key in actual_frequency.keys():
-      self.assertAlmostEqual(actual_frequency[key], expected_return[key])
+    actual_frequency = updated_dv_call.allele_frequency
+    self._assert_freq_dict_allclose(actual_frequency, expected_return)
 
 
 if __name__ == '__main__':
@@ -74,8 +74,9 @@ def create_html_report(charts: List[Dict[Text, alt.Chart]],
 
   chart_div_style = 'style="display:block"' if charts_on_separate_lines else ''
 
-  # Start the HTML document.
-  html_string = (
+  # Start the HTML document. The document is built as a list of strings that
+  # are joined once at the end.
+  html_parts = [(
       f'<!DOCTYPE html>\n<html>\n<head>\n'
       # Add dependencies vega and vega-lite, which render the altair charts.
       f'<script type="text/javascript" src="{VEGA_URL}/vega@5"></script>\n'
@@ -90,27 +91,29 @@ def create_html_report(charts: List[Dict[Text, alt.Chart]],
       f'<h1>{title}</h1>\n'
       f'<h2>{subtitle}</h2>\n'
       # Make a div containing all the charts.
-      '<div>')
+      '<div>')]
   if include_outline:
-    html_string += ('<h3>Outline</h3>\n')
-    html_string += ('<ul>\n')
+    html_parts.append('<h3>Outline</h3>\n')
+    html_parts.append('<ul>\n')
     for chart in charts:
       chart_id = chart['id']
-      html_string += (f'  <li><a href="#a_{chart_id}">{chart_id}</a></li>\n')
-    html_string += ('</ul>\n')
+      html_parts.append(f'  <li><a href="#a_{chart_id}">{chart_id}</a></li>\n')
+    html_parts.append('</ul>\n')
 
   for chart in charts:
     chart_id = chart['id']
-    html_string += (f'<a name="a_{chart_id}"></a>\n')
-    html_string += (f'<div class="chart-container" {chart_div_style} '
-                    f'id="vis_{chart_id}"></div>\n')
+    html_parts.append(f'<a name="a_{chart_id}"></a>\n')
+    html_parts.append(f'<div class="chart-container" {chart_div_style} '
+                      f'id="vis_{chart_id}"></div>\n')
   # End the chart container and start the JavaScript section.
-  html_string += ('</div>' '<script>\n')
+  html_parts.append('</div>' '<script>\n')
 
   # Add JSON vega specs and hook them up to the divs with VegaEmbed.
   for chart in charts:
     chart_id = chart['id']
-    chart_json = chart['chart'].to_json()
+    # Without indentation, json.dumps uses its C encoder and the embedded data
+    # takes up far less space in the report.
+    chart_json = chart['chart'].to_json(indent=None, separators=(',', ':'))
     download_filename = '{}_{}'.format(title.replace(' ', '_'), chart['id'])
     embed_options = {
         'mode': 'vega-lite',
@@ -119,12 +122,12 @@ def create_html_report(charts: List[Dict[Text, alt.Chart]],
             'target': '_blank'
         }
     }
-    html_string += (
+    html_parts.append(
         f'var spec_{chart_id} = {chart_json};\n'
         f'vegaEmbed("#vis_{chart_id}", spec_{chart_id}, {embed_options})\n')
-  html_string += (
+  html_parts.append(
       '</script>\n'
       # Close HTML document.
       '</body></html>')
 
-  html_output.write(html_string)
+  html_output.write(''.join(html_parts))
@@ -28,6 +28,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """Core functionality for step one of DeepVariant: Making examples."""
 
+import bisect
 import collections
 import dataclasses
 import os
@@ -531,12 +532,47 @@ def regions_to_process(contigs,
   regions = ranges.RangeSet.from_contigs(contigs)
   if calling_regions:
     regions = regions.intersection(calling_regions)
-  partitioned = regions.partition(partition_size)
 
   if num_shards:
-    return (r for i, r in enumerate(partitioned) if i % num_shards == task_id)
+    return _partition_for_task(regions, partition_size, task_id, num_shards)
   else:
-    return partitioned
+    return regions.partition(partition_size)
+
+
+def _partition_for_task(regions, partition_size, task_id, num_shards):
+  """Yields the partitions of regions that belong to task_id.
+
+  This is equivalent to keeping every num_shards-th element, starting at
+  task_id, of regions.partition(partition_size), but computes the positions of
+  this task's partitions directly so that we only make Range protos for the
+  partitions this task is going to process.
+
+  Args:
+    regions: RangeSet. The regions to partition.
+    partition_size: The maximum size to make any region when partitioning.
+    task_id: int >= 0 and < num_shards. The task_id of this job.
+    num_shards: int > 0. The number of shards we are running in parallel.
+
+  Yields:
+    nucleus.genomics.v1.Range protos, in the same order as
+    regions.partition(partition_size).
+
+  Raises:
+    ValueError: if partition_size <= 0.
+  """
+  if partition_size <= 0:
+    raise ValueError('max_size must be > 0: {}'.format(partition_size))
+
+  # Index, across all regions, of the first partition of the current region.
+  first_index = 0
+  for region in regions:
+    n_partitions = -(-(region.end - region.start) // partition_size)
+    for i in range((task_id - first_index) % num_shards, n_partitions,
+                   num_shards):
+      start = region.start + i * partition_size
+      yield ranges.make_range(region.reference_name, start,
+                              min(region.end, start + partition_size))
+    first_index += n_partitions
 
 
 def fetch_vcf_positions(vcf_path, contigs, calling_regions):
@@ -580,39 +616,43 @@ def filter_regions_by_vcf(regions, variant_positions):
         input regions and contains at least one of the input variants.
   """
 
-  def dict_by_chromosome(list_of_ranges):
-    d = collections.defaultdict(list)
-    for r in list_of_ranges:
-      d[r.reference_name].append(r)
-    for c in d:
-      d[c] = sorted(d[c], key=lambda x: (x.start, x.end))
-    return d
+  regions_by_chrom = collections.defaultdict(list)
+  for r in regions:
+    regions_by_chrom[r.reference_name].append(r)
+  # Only the start of each variant matters, so we sort plain ints rather than
+  # the Range protos themselves.
+  variant_starts_by_chrom = collections.defaultdict(list)
+  for v in variant_positions:
+    variant_starts_by_chrom[v.reference_name].append(v.start)
 
-  region_dict = dict_by_chromosome(regions)
-  variant_dict = dict_by_chromosome(variant_positions)
   filtered_regions = []
-  for c in region_dict:
-    ri = 0
-    vi = 0
-    if c not in variant_dict:
+  for c, chrom_regions in regions_by_chrom.items():
+    if c not in variant_starts_by_chrom:
       # Skip chromosomes with no variants.
       continue
-    while ri < len(region_dict[c]) and vi < len(variant_dict[c]):
-      region = region_dict[c][ri]
-      variant = variant_dict[c][vi]
-      if variant.start >= region.start and variant.start < region.end:
+    chrom_regions = sorted(chrom_regions, key=lambda x: (x.start, x.end))
+    variant_starts = sorted(variant_starts_by_chrom[c])
+    ri = 0
+    vi = 0
+    while ri < len(chrom_regions) and vi < len(variant_starts):
+      region = chrom_regions[ri]
+      variant_start = variant_starts[vi]
+      if variant_start >= region.start and variant_start < region.end:
         # When the variant falls within the region, then keep the region.
         filtered_regions.append(region)
         # Move both indices because we're already keeping this region, and we
         # don't need to see any more variants inside this same region.
         ri += 1
         vi += 1
-      elif region.start < variant.start:
+      elif region.start < variant_start:
         # Move past this region since the next variant comes later.
         ri += 1
       else:
-        # Found another variant in the previous region we already included.
-        vi += 1
+        # Skip this variant and all later ones before this region in a single
+        # binary search, rather than stepping over them one at a time. This
+        # branch is also reached for an empty region starting at the variant,
+        # so always move past vi.
+        vi = bisect.bisect_left(variant_starts, region.start, vi + 1)
 
   return filtered_regions
 
@@ -28,11 +28,10 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """Tests for deepvariant.make_examples_core."""
 
-import copy
+import functools
 
 
 
-from absl import flags
 from absl.testing import absltest
 from absl.testing import flagsaver
 from absl.testing import parameterized
@@ -55,8 +54,6 @@ from deepvariant.labeler import variant_labeler
 from deepvariant.protos import deepvariant_pb2
 from deepvariant.protos import realigner_pb2
 
-FLAGS = flags.FLAGS
-
 
 def setUpModule():
   testdata.init()
@@ -96,13 +93,42 @@ def _from_literals(literals, contig_map=None):
   return ranges.RangeSet.from_regions(literals, contig_map)
 
 
+def _as_sorted_keys(ranges_iter):
+  """Returns sorted (reference_name, start, end) tuples for ranges_iter."""
+  return sorted((r.reference_name, r.start, r.end) for r in ranges_iter)
+
+
+# Contigs shared across many test cases. These are only ever read, so they are
+# built once at import time instead of once per parameterized case.
+_CONTIGS_1_100_2_200 = _make_contigs([('1', 100), ('2', 200)])
+_CONTIGS_1_100_2_76_3_121 = _make_contigs([('1', 100), ('2', 76), ('3', 121)])
+_CONTIGS_Z_A_N = _make_contigs([('z', 100), ('a', 100), ('n', 100)])
+
+# The region processed in RegionProcessorTest. No test modifies it.
+_REGION = ranges.parse_literal('chr20:10,000,000-10,000,100')
+
+
+@functools.lru_cache(maxsize=None)
+def _contigs_by_names(names):
+  """Returns a tuple of 100bp ContigInfo protos for names, memoized."""
+  return tuple(_make_contigs([(name, 100) for name in names]))
+
+
+@functools.lru_cache(maxsize=None)
+def _unsharded_z_a_n_regions(partition_size):
+  """Returns the unsharded regions_to_process over _CONTIGS_Z_A_N, memoized."""
+  return tuple(
+      make_examples_core.regions_to_process(
+          contigs=_CONTIGS_Z_A_N, partition_size=partition_size))
+
+
 class MakeExamplesCoreUnitTest(parameterized.TestCase):
 
   def test_read_write_run_info(self):
 
-    def _read_lines(path):
-      with open(path) as fin:
-        return list(fin.readlines())
+    def _read_bytes(path):
+      with open(path, 'rb') as fin:
+        return fin.read()
 
     golden_actual = make_examples_core.read_make_examples_run_info(
         testdata.GOLDEN_MAKE_EXAMPLES_RUN_INFO)
@@ -116,12 +142,12 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
     self.assertEqual(golden_actual.labeling_metrics.n_candidate_variant_sites,
                      testdata.N_GOLDEN_TRAINING_EXAMPLES)
 
-    # Check that reading + writing the data produces the same lines:
+    # Check that reading + writing the data produces the same bytes:
     tmp_output = test_utils.test_tmpfile('written_run_info.pbtxt')
     make_examples_core.write_make_examples_run_info(golden_actual, tmp_output)
     self.assertEqual(
-        _read_lines(testdata.GOLDEN_MAKE_EXAMPLES_RUN_INFO),
-        _read_lines(tmp_output))
+        _read_bytes(testdata.GOLDEN_MAKE_EXAMPLES_RUN_INFO),
+        _read_bytes(tmp_output))
 
   @parameterized.parameters(
       dict(
@@ -173,16 +199,15 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
         make_examples_core.extract_sample_name_from_sam_reader(
             mock_sample_reader))
 
-  @flagsaver.flagsaver
   def test_confident_regions(self):
-    FLAGS.ref = testdata.CHR20_FASTA
-    FLAGS.reads = testdata.CHR20_BAM
-    FLAGS.truth_variants = testdata.TRUTH_VARIANTS_VCF
-    FLAGS.confident_regions = testdata.CONFIDENT_REGIONS_BED
-    FLAGS.mode = 'training'
-    FLAGS.examples = ''
-
-    options = make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(
+        ref=testdata.CHR20_FASTA,
+        reads=testdata.CHR20_BAM,
+        truth_variants=testdata.TRUTH_VARIANTS_VCF,
+        confident_regions=testdata.CONFIDENT_REGIONS_BED,
+        mode='training',
+        examples=''):
+      options = make_examples.default_options(add_flags=True)
     confident_regions = make_examples_core.read_confident_regions(options)
 
     # Our expected intervals, inlined from CONFIDENT_REGIONS_BED.
@@ -195,26 +220,19 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
         'chr20:10009934-10010531'
     ])
     # Our confident regions should be exactly those found in the BED file.
-    six.assertCountEqual(self, expected, list(confident_regions))
+    self.assertEqual(
+        _as_sorted_keys(expected), _as_sorted_keys(confident_regions))
 
-  @flagsaver.flagsaver
   def test_gvcf_output_enabled_is_false_without_gvcf_flag(self):
-    FLAGS.mode = 'training'
-    FLAGS.gvcf = ''
-    FLAGS.reads = ''
-    FLAGS.ref = ''
-    FLAGS.examples = ''
-    options = make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(
+        mode='training', gvcf='', reads='', ref='', examples=''):
+      options = make_examples.default_options(add_flags=True)
     self.assertFalse(make_examples_core.gvcf_output_enabled(options))
 
-  @flagsaver.flagsaver
   def test_gvcf_output_enabled_is_true_with_gvcf_flag(self):
-    FLAGS.mode = 'training'
-    FLAGS.gvcf = '/tmp/foo.vcf'
-    FLAGS.reads = ''
-    FLAGS.ref = ''
-    FLAGS.examples = ''
-    options = make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(
+        mode='training', gvcf='/tmp/foo.vcf', reads='', ref='', examples=''):
+      options = make_examples.default_options(add_flags=True)
     self.assertTrue(make_examples_core.gvcf_output_enabled(options))
 
   def test_validate_ref_contig_coverage(self):
@@ -291,11 +309,12 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
       (['1:25-30', '1:20-40'], ['1:20-40']),
   )
   def test_regions_to_process(self, calling_regions, expected):
-    contigs = _make_contigs([('1', 100), ('2', 200)])
-    six.assertCountEqual(
-        self, _from_literals_list(expected),
-        make_examples_core.regions_to_process(
-            contigs, 1000, calling_regions=_from_literals(calling_regions)))
+    actual = make_examples_core.regions_to_process(
+        _CONTIGS_1_100_2_200,
+        1000,
+        calling_regions=_from_literals(calling_regions))
+    self.assertEqual(
+        _as_sorted_keys(_from_literals_list(expected)), _as_sorted_keys(actual))
 
   @parameterized.parameters(
       (50, None, [
@@ -309,11 +328,12 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
   )
   def test_regions_to_process_partition(self, max_size, calling_regions,
                                         expected):
-    contigs = _make_contigs([('1', 100), ('2', 76), ('3', 121)])
-    six.assertCountEqual(
-        self, _from_literals_list(expected),
-        make_examples_core.regions_to_process(
-            contigs, max_size, calling_regions=_from_literals(calling_regions)))
+    actual = make_examples_core.regions_to_process(
+        _CONTIGS_1_100_2_76_3_121,
+        max_size,
+        calling_regions=_from_literals(calling_regions))
+    self.assertEqual(
+        _as_sorted_keys(_from_literals_list(expected)), _as_sorted_keys(actual))
 
   @parameterized.parameters(
       dict(includes=[], excludes=[], expected=['1:1-100', '2:1-200']),
@@ -346,10 +366,10 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
           expected=['1:14-18', '2:70-80']),
   )
   def test_build_calling_regions(self, includes, excludes, expected):
-    contigs = _make_contigs([('1', 100), ('2', 200)])
-    actual = make_examples_core.build_calling_regions(contigs, includes,
-                                                      excludes)
-    six.assertCountEqual(self, actual, _from_literals_list(expected))
+    actual = make_examples_core.build_calling_regions(_CONTIGS_1_100_2_200,
+                                                      includes, excludes)
+    self.assertEqual(
+        _as_sorted_keys(actual), _as_sorted_keys(_from_literals_list(expected)))
 
   def test_regions_to_process_sorted_within_contig(self):
     # These regions are out of order but within a single contig.
@@ -365,12 +385,11 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
 
   def test_regions_to_process_sorted_contigs(self):
     # These contig names are out of order lexicographically.
-    contigs = _make_contigs([('z', 100), ('a', 100), ('n', 100)])
     in_regions = _from_literals(['a:10', 'n:1', 'z:20', 'z:5'])
     sorted_regions = _from_literals_list(['z:5', 'z:20', 'a:10', 'n:1'])
     actual_regions = list(
         make_examples_core.regions_to_process(
-            contigs, 100, calling_regions=in_regions))
+            _CONTIGS_Z_A_N, 100, calling_regions=in_regions))
     # The assertEqual here is checking the order is exactly what we expect.
     self.assertEqual(sorted_regions, actual_regions)
 
@@ -380,18 +399,60 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
 
     def get_regions(task_id, num_shards):
       return make_examples_core.regions_to_process(
-          contigs=_make_contigs([('z', 100), ('a', 100), ('n', 100)]),
+          contigs=_CONTIGS_Z_A_N,
           partition_size=5,
           task_id=task_id,
           num_shards=num_shards)
 
-    # Check that the regions are the same unsharded vs. sharded.
-    unsharded_regions = get_regions(0, 0)
-    sharded_regions = []
+    # Check that each task gets a deterministic stride of the unsharded
+    # regions, which implies the regions are the same unsharded vs. sharded.
+    unsharded_regions = _unsharded_z_a_n_regions(5)
+    for task_id in range(num_shards):
+      self.assertEqual(
+          list(unsharded_regions[task_id::num_shards]),
+          list(get_regions(task_id, num_shards)))
+
+  @parameterized.parameters(
+      (partition_size, num_shards, calling_regions)
+      for partition_size in [7, 50]
+      for num_shards in [2, 3, 5]
+      for calling_regions in
+      [None, ['1:3-40', '1:61-100', '2:10-11', '3:5-121']])
+  def test_regions_to_process_sharding_uneven_partitions(
+      self, partition_size, num_shards, calling_regions):
+    """Sharded partitions match a stride over the unsharded partitions."""
+    if calling_regions is not None:
+      calling_regions = _from_literals(calling_regions)
+    unsharded_regions = list(
+        make_examples_core.regions_to_process(
+            contigs=_CONTIGS_1_100_2_76_3_121,
+            partition_size=partition_size,
+            calling_regions=calling_regions))
     for task_id in range(num_shards):
-      task_regions = get_regions(task_id, num_shards)
-      sharded_regions.extend(task_regions)
-    six.assertCountEqual(self, unsharded_regions, sharded_regions)
+      expected = [
+          r for i, r in enumerate(unsharded_regions)
+          if i % num_shards == task_id
+      ]
+      self.assertEqual(
+          expected,
+          list(
+              make_examples_core.regions_to_process(
+                  contigs=_CONTIGS_1_100_2_76_3_121,
+                  partition_size=partition_size,
+                  calling_regions=calling_regions,
+                  task_id=task_id,
+                  num_shards=num_shards)))
+
+  @parameterized.parameters([0, -1])
+  def test_regions_to_process_sharding_fails_with_bad_partition_size(
+      self, partition_size):
+    with self.assertRaises(ValueError):
+      list(
+          make_examples_core.regions_to_process(
+              contigs=_CONTIGS_Z_A_N,
+              partition_size=partition_size,
+              task_id=0,
+              num_shards=2))
 
   @parameterized.parameters(
       # Providing one of task id and num_shards but not the other is bad.
@@ -409,7 +470,7 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
   def test_regions_to_process_fails_with_bad_shard_args(self, task, num_shards):
     with self.assertRaises(ValueError):
       make_examples_core.regions_to_process(
-          contigs=_make_contigs([('z', 100), ('a', 100), ('n', 100)]),
+          contigs=_CONTIGS_Z_A_N,
           partition_size=10,
           task_id=task,
           num_shards=num_shards)
@@ -442,6 +503,9 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
       # Multiple variants in the same region.
       (['x:11-20', 'x:21-30'
        ], ['x:1-2', 'x:25-26', 'x:25-26', 'x:26-27', 'x:40-50'], [1]),
+      # An empty region starting at a variant keeps nothing.
+      (['x:6-5'], ['x:6-6'], []),
+      (['x:6-5', 'x:11-20'], ['x:6-6', 'x:15-16'], [1]),
       # A variant spanning multiple regions belongs where it starts.
       (['x:1-10', 'x:11-20', 'x:21-30', 'x:31-40', 'x:41-50', 'x:51-60'
        ], ['x:15-66'], [1]),
@@ -456,6 +520,25 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
     list_expected = [regions[i] for i in regions_to_keep]
     self.assertEqual(list_output, list_expected)
 
+  @parameterized.parameters((100, 1000), (1000, 10000))
+  def test_filter_regions_by_vcf_many_variants(self, num_regions,
+                                               num_variants):
+    # Regions of 100bp each, with variants densely packed into every other
+    # region so that only the even-numbered regions should be kept.
+    regions = [
+        ranges.make_range('x', i * 100, (i + 1) * 100)
+        for i in range(num_regions)
+    ]
+    variants_per_region = 2 * num_variants // num_regions
+    variant_positions = []
+    for i in range(0, num_regions, 2):
+      for j in range(variants_per_region):
+        start = i * 100 + j % 100
+        variant_positions.append(ranges.make_range('x', start, start + 1))
+    output = make_examples_core.filter_regions_by_vcf(regions,
+                                                      variant_positions)
+    self.assertEqual(list(output), regions[::2])
+
   @parameterized.parameters(
       dict(
           ref_names=['1', '2', '3'],
@@ -489,10 +572,10 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
   def test_ensure_consistent_contigs(self, ref_names, sam_names, vcf_names,
                                      names_to_exclude, min_coverage_fraction,
                                      expected_names):
-    ref_contigs = _make_contigs([(name, 100) for name in ref_names])
-    sam_contigs = _make_contigs([(name, 100) for name in sam_names])
+    ref_contigs = list(_contigs_by_names(tuple(ref_names)))
+    sam_contigs = list(_contigs_by_names(tuple(sam_names)))
     if vcf_names is not None:
-      vcf_contigs = _make_contigs([(name, 100) for name in vcf_names])
+      vcf_contigs = list(_contigs_by_names(tuple(vcf_names)))
     else:
       vcf_contigs = None
     actual = make_examples_core._ensure_consistent_contigs(
@@ -516,10 +599,10 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
   )
   def test_ensure_inconsistent_contigs(self, ref_names, sam_names, vcf_names,
                                        names_to_exclude, min_coverage_fraction):
-    ref_contigs = _make_contigs([(name, 100) for name in ref_names])
-    sam_contigs = _make_contigs([(name, 100) for name in sam_names])
+    ref_contigs = list(_contigs_by_names(tuple(ref_names)))
+    sam_contigs = list(_contigs_by_names(tuple(sam_names)))
     if vcf_names is not None:
-      vcf_contigs = _make_contigs([(name, 100) for name in vcf_names])
+      vcf_contigs = list(_contigs_by_names(tuple(vcf_names)))
     else:
       vcf_contigs = None
     with six.assertRaisesRegex(self, ValueError, 'Reference contigs span'):
@@ -528,16 +611,15 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
                                                     names_to_exclude,
                                                     min_coverage_fraction)
 
-  @flagsaver.flagsaver
   def test_regions_and_exclude_regions_flags(self):
-    FLAGS.mode = 'calling'
-    FLAGS.ref = testdata.CHR20_FASTA
-    FLAGS.reads = testdata.CHR20_BAM
-    FLAGS.regions = 'chr20:10,000,000-11,000,000'
-    FLAGS.examples = 'examples.tfrecord'
-    FLAGS.exclude_regions = 'chr20:10,010,000-10,100,000'
-
-    options = make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(
+        mode='calling',
+        ref=testdata.CHR20_FASTA,
+        reads=testdata.CHR20_BAM,
+        regions='chr20:10,000,000-11,000,000',
+        examples='examples.tfrecord',
+        exclude_regions='chr20:10,010,000-10,100,000'):
+      options = make_examples.default_options(add_flags=True)
     six.assertCountEqual(
         self,
         list(
@@ -546,16 +628,15 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
         _from_literals_list(
             ['chr20:10,000,000-10,009,999', 'chr20:10,100,001-11,000,000']))
 
-  @flagsaver.flagsaver
   def test_incorrect_empty_regions(self):
-    FLAGS.mode = 'calling'
-    FLAGS.ref = testdata.CHR20_FASTA
-    FLAGS.reads = testdata.CHR20_BAM
-    # Deliberately incorrect contig name.
-    FLAGS.regions = '20:10,000,000-11,000,000'
-    FLAGS.examples = 'examples.tfrecord'
-
-    options = make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(
+        mode='calling',
+        ref=testdata.CHR20_FASTA,
+        reads=testdata.CHR20_BAM,
+        # Deliberately incorrect contig name.
+        regions='20:10,000,000-11,000,000',
+        examples='examples.tfrecord'):
+      options = make_examples.default_options(add_flags=True)
     with six.assertRaisesRegex(self, ValueError,
                                'The regions to call is empty.'):
       make_examples_core.processing_regions_from_options(options)
@@ -563,13 +644,29 @@ class MakeExamplesCoreUnitTest(parameterized.TestCase):
 
 class RegionProcessorTest(parameterized.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    super(RegionProcessorTest, cls).setUpClass()
+    # Every test starts from the same default options, so only build them once.
+    with flagsaver.flagsaver(reads=''):
+      cls._base_options = make_examples.default_options(add_flags=False)
+
+    # Inputs for test_align_to_all_haplotypes, which are the same for every
+    # window width.
+    cls._hap_region = ranges.parse_literal('chr20:10,046,000-10,046,400')
+    with vcf.VcfReader(testdata.TRUTH_VARIANTS_VCF) as nist_reader:
+      cls._hap_variants = list(nist_reader.query(cls._hap_region))
+    # align_to_all_haplotypes() trims copies of the reads, so this is not
+    # modified by the test and can be shared.
+    cls._hap_read = test_utils.make_read(
+        'A' * 101, start=10046100, cigar='101M', quals=[30] * 101)
+
   def setUp(self):
     super(RegionProcessorTest, self).setUp()
-    self._saved_flags = flagsaver.save_flag_values()
-    self.region = ranges.parse_literal('chr20:10,000,000-10,000,100')
+    self.region = _REGION
 
-    FLAGS.reads = ''
-    self.options = make_examples.default_options(add_flags=False)
+    self.options = deepvariant_pb2.MakeExamplesOptions()
+    self.options.CopyFrom(self._base_options)
     self.options.reference_filename = testdata.CHR20_FASTA
     main_sample = self.options.sample_options[0]
     if not main_sample.reads_filenames:
@@ -585,10 +682,7 @@ class RegionProcessorTest(parameterized.TestCase):
       sample.in_memory_sam_reader = mock.Mock()
     self.default_shape = [5, 5, 7]
     self.default_format = 'raw'
-
-  def tearDown(self):
-    super(RegionProcessorTest, self).tearDown()
-    flagsaver.restore_flag_values(self._saved_flags)
+    self.default_format_bytes = b'raw'
 
   def add_mock(self, name, retval='dontadd', side_effect='dontadd'):
     patcher = mock.patch.object(self.processor, name, autospec=True)
@@ -681,10 +775,12 @@ class RegionProcessorTest(parameterized.TestCase):
     self.processor.options.mode = mode
 
     main_sample = self.processor.samples[0]
-    mock_read = mock.MagicMock()
-    mock_candidate = mock.MagicMock()
-    mock_example = mock.MagicMock()
-    mock_label = mock.MagicMock()
+    # These are only passed through and compared by identity, so plain objects
+    # are enough.
+    mock_read = object()
+    mock_candidate = object()
+    mock_example = object()
+    mock_label = object()
     mock_rr = self.add_mock('region_reads', retval=[mock_read])
     mock_cir = self.add_mock(
         'candidates_in_region',
@@ -726,10 +822,12 @@ class RegionProcessorTest(parameterized.TestCase):
   def test_process_keeps_ordering_of_candidates_and_examples(self, mode):
     self.processor.options.mode = mode
 
-    r1, r2 = mock.Mock(), mock.Mock()
-    c1, c2 = mock.Mock(), mock.Mock()
-    l1, l2 = mock.Mock(), mock.Mock()
-    e1, e2, e3 = mock.Mock(), mock.Mock(), mock.Mock()
+    # These are only passed through and compared by identity, so plain objects
+    # are enough.
+    r1, r2 = object(), object()
+    c1, c2 = object(), object()
+    l1, l2 = object(), object()
+    e1, e2, e3 = object(), object(), object()
     main_sample = self.processor.samples[0]
     self.add_mock('region_reads', retval=[r1, r2])
     self.add_mock(
@@ -882,15 +980,15 @@ class RegionProcessorTest(parameterized.TestCase):
     self.add_mock(
         '_encode_tensor',
         side_effect=[
-            (six.b('tensor1'), self.default_shape, self.default_format),
-            (six.b('tensor2'), self.default_shape, self.default_format)
+            (b'tensor1', self.default_shape, self.default_format),
+            (b'tensor2', self.default_shape, self.default_format)
         ])
     dv_call = mock.Mock()
     dv_call.variant = test_utils.make_variant(start=10, alleles=['A', 'C', 'G'])
     ex = mock.Mock()
     alt1, alt2 = ['C'], ['G']
     self.processor.pic.create_pileup_images.return_value = [
-        (alt1, six.b('tensor1')), (alt2, six.b('tensor2'))
+        (alt1, b'tensor1'), (alt2, b'tensor2')
     ]
 
     actual = self.processor.create_pileup_examples(dv_call)
@@ -903,14 +1001,14 @@ class RegionProcessorTest(parameterized.TestCase):
         sample_order=None)
 
     self.assertLen(actual, 2)
-    for ex, (alt, img) in zip(actual, [(alt1, six.b('tensor1')),
-                                       (alt2, six.b('tensor2'))]):
+    for ex, (alt, img) in zip(actual, [(alt1, b'tensor1'),
+                                       (alt2, b'tensor2')]):
       self.assertEqual(tf_utils.example_alt_alleles(ex), alt)
       self.assertEqual(tf_utils.example_variant(ex), dv_call.variant)
       self.assertEqual(tf_utils.example_encoded_image(ex), img)
       self.assertEqual(tf_utils.example_image_shape(ex), self.default_shape)
       self.assertEqual(
-          tf_utils.example_image_format(ex), six.b(self.default_format))
+          tf_utils.example_image_format(ex), self.default_format_bytes)
 
   @parameterized.parameters(
       # Test that a het variant gets a label value of 1 assigned to the example.
@@ -931,17 +1029,23 @@ class RegionProcessorTest(parameterized.TestCase):
       ),
   )
   def test_add_label_to_example(self, label, expected_label_value):
-    example = self._example_for_variant(label.variant)
-    labeled = copy.deepcopy(example)
+    labeled = self._example_for_variant(label.variant)
+    # Snapshot the serialized features before labeling, rather than copying
+    # the whole example (including its image bytes).
+    original_features = {
+        key: value.SerializeToString()
+        for key, value in labeled.features.feature.items()
+        if key != 'variant/encoded'  # Special case tested below.
+    }
     actual = self.processor.add_label_to_example(labeled, label)
 
     # The add_label_to_example command modifies labeled and returns it.
     self.assertIs(actual, labeled)
 
-    # Check that all keys from example are present in labeled.
-    for key, value in example.features.feature.items():
-      if key != 'variant/encoded':  # Special case tested below.
-        self.assertEqual(value, labeled.features.feature[key])
+    # Check that all keys from the original example are present, unchanged, in
+    # labeled.
+    for key, value in original_features.items():
+      self.assertEqual(value, labeled.features.feature[key].SerializeToString())
 
     # The genotype of our example_variant should be set to the true genotype
     # according to our label.
@@ -967,26 +1071,31 @@ class RegionProcessorTest(parameterized.TestCase):
         self, ValueError, 'Cannot add a non-confident label to an example'):
       self.processor.add_label_to_example(example, label)
 
+  def _calling_flag_values(self, **flag_values):
+    """Returns flag values for a minimal calling run, updated by flag_values."""
+    return dict(
+        mode='calling',
+        ref=testdata.CHR20_FASTA,
+        reads=testdata.CHR20_BAM,
+        examples='examples.tfrecord',
+        **flag_values)
+
   def _example_for_variant(self, variant):
     return tf_utils.make_example(variant, list(variant.alternate_bases),
-                                 six.b('foo'), self.default_shape,
+                                 b'foo', self.default_shape,
                                  self.default_format)
 
   @parameterized.parameters('sort_by_haplotypes', 'use_original_quality_scores')
   def test_flags_strictly_needs_sam_aux_fields(
       self, flags_strictly_needs_sam_aux_fields):
-    FLAGS.mode = 'calling'
-    FLAGS.ref = testdata.CHR20_FASTA
-    FLAGS.reads = testdata.CHR20_BAM
-    FLAGS.examples = 'examples.tfrecord'
-    FLAGS[flags_strictly_needs_sam_aux_fields].value = True
-    FLAGS.parse_sam_aux_fields = False
-
-    with six.assertRaisesRegex(
-        self, Exception,
-        'If --{} is set then --parse_sam_aux_fields must be set too.'.format(
-            flags_strictly_needs_sam_aux_fields)):
-      make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(**self._calling_flag_values(
+        parse_sam_aux_fields=False,
+        **{flags_strictly_needs_sam_aux_fields: True})):
+      with six.assertRaisesRegex(
+          self, Exception,
+          'If --{} is set then --parse_sam_aux_fields must be set too.'.format(
+              flags_strictly_needs_sam_aux_fields)):
+        make_examples.default_options(add_flags=True)
 
   @parameterized.parameters(
       ('add_hp_channel', True, None),
@@ -999,15 +1108,11 @@ class RegionProcessorTest(parameterized.TestCase):
   def test_flag_optionally_needs_sam_aux_fields_with_different_parse_sam_aux_fields(
       self, flag_optionally_needs_sam_aux_fields, parse_sam_aux_fields,
       expected_message):
-    FLAGS.mode = 'calling'
-    FLAGS.ref = testdata.CHR20_FASTA
-    FLAGS.reads = testdata.CHR20_BAM
-    FLAGS.examples = 'examples.tfrecord'
-    FLAGS[flag_optionally_needs_sam_aux_fields].value = True
-    FLAGS.parse_sam_aux_fields = parse_sam_aux_fields
-
-    with self.assertLogs() as logs:
-      make_examples.default_options(add_flags=True)
+    with flagsaver.flagsaver(**self._calling_flag_values(
+        parse_sam_aux_fields=parse_sam_aux_fields,
+        **{flag_optionally_needs_sam_aux_fields: True})):
+      with self.assertLogs() as logs:
+        make_examples.default_options(add_flags=True)
     aux_fields_log_messages = [
         x for x in logs.output if '--parse_sam_aux_fields' in x
     ]
@@ -1025,30 +1130,26 @@ class RegionProcessorTest(parameterized.TestCase):
       ],)
   def test_align_to_all_haplotypes(self, window_width):
     # align_to_all_haplotypes() will pull from the reference, so choose a
-    # real variant.
-    region = ranges.parse_literal('chr20:10,046,000-10,046,400')
-    nist_reader = vcf.VcfReader(testdata.TRUTH_VARIANTS_VCF)
-    nist_variants = list(nist_reader.query(region))
-    # We picked this region to have exactly one known variant:
+    # real variant. We picked _hap_region to have exactly one known variant:
     # reference_bases: "AAGAAAGAAAG"
     # alternate_bases: "A", a deletion of 10 bp
     # start: 10046177
     # end: 10046188
     # reference_name: "chr20"
-
-    variant = nist_variants[0]
+    # Copy it, since we modify reference_bases below.
+    variant = type(self._hap_variants[0])()
+    variant.CopyFrom(self._hap_variants[0])
 
     self.processor.pic = mock.Mock()
     self.processor.pic.width = window_width
-    self.processor.pic.half_width = int((self.processor.pic.width - 1) / 2)
+    self.processor.pic.half_width = (window_width - 1) // 2
 
     self.processor.realigner = mock.Mock()
     # Using a real ref_reader to test that the reference allele matches
     # between the variant and the reference at the variant's coordinates.
     self.processor.realigner.ref_reader = self.ref_reader
 
-    read = test_utils.make_read(
-        'A' * 101, start=10046100, cigar='101M', quals=[30] * 101)
+    read = self._hap_read
 
     self.processor.realigner.align_to_haplotype = mock.Mock()
     alt_info = self.processor.align_to_all_haplotypes(variant, [read])
@@ -32,11 +32,18 @@ Use this script to visualize the runtime-by-region data generated by running
 make_examples with --runtime_by_region.
 """
 
-from typing import Dict, Sequence, List, Tuple, Text, Union
+import concurrent.futures
+import hashlib
+import os
+import pickle
+import uuid
+from typing import Dict, Optional, Sequence, List, Tuple, Text, Union
 
 from absl import app
 from absl import flags
+from absl import logging
 import altair as alt
+import numpy as np
 import pandas as pd
 import tensorflow as tf
 
@@ -60,6 +67,16 @@ flags.DEFINE_string(
     'be used as a prefix for downloaded image files.')
 flags.DEFINE_string('output', 'runtime_by_region_report.html',
                     'Path for the output report, which will be an html file.')
+flags.DEFINE_string(
+    'cache_dir', None, 'Optional directory for caching the parsed input. '
+    'Re-running on unchanged input files then skips parsing the TSV files. '
+    'The cache is stored as Python pickles, and loading a pickle can run '
+    'arbitrary code, so this must be a private directory that only you can '
+    'write to. Do not point it at a shared directory.')
+
+# Version of the cached dataframe's layout. Bump this whenever parsing changes
+# (columns, dtypes, etc.) so that older cache files are not reused.
+_CACHE_FORMAT_VERSION = 1
 
 RUNTIME_COLUMNS = [
     'get reads', 'find candidates', 'make pileup images', 'write outputs'
@@ -78,11 +95,74 @@ CSS_STYLES = """
 """
 
 
-def read_sharded_runtime_tsvs(path_string: str) -> pd.DataFrame:
+def _read_runtime_tsv(path: str) -> pd.DataFrame:
+  """Reads a single, unsharded TSV file into a pandas dataframe."""
+  # Counts fit easily in int32. Runtimes stay float64 because float32 values
+  # serialize with spurious digits (0.148 -> 0.14800000190734863) in the
+  # JSON specs, which would make the report larger instead of smaller.
+  dtype = dict.fromkeys(COUNT_COLUMNS, np.int32)
+  if path.startswith('gs://'):
+    # Once pandas is updated to 0.24+, pd.read_csv will work for gs://
+    # without this workaround.
+    with tf.io.gfile.GFile(path) as f:
+      return pd.read_csv(f, sep='\t', dtype=dtype)
+  return pd.read_csv(path, sep='\t', dtype=dtype)
+
+
+def _cache_path(paths: Sequence[str], cache_dir: str) -> str:
+  """Returns a cache file path that changes whenever an input file changes."""
+  digest = hashlib.blake2b(digest_size=16)
+  # Pickled dataframes are not portable across pandas versions.
+  digest.update(
+      f'format {_CACHE_FORMAT_VERSION}\tpandas {pd.__version__}\n'.encode())
+  for path in paths:
+    stat = tf.io.gfile.stat(path)
+    digest.update(f'{path}\t{stat.mtime_nsec}\t{stat.length}\n'.encode())
+  return os.path.join(cache_dir, f'runtime_by_region_{digest.hexdigest()}.pkl')
+
+
+def _read_cache(cache_path: str) -> Optional[pd.DataFrame]:
+  """Returns the cached dataframe, or None if it is missing or unreadable."""
+  if not tf.io.gfile.exists(cache_path):
+    return None
+  try:
+    # Unpickling trusts the file completely, which is why --cache_dir must be a
+    # private directory.
+    with tf.io.gfile.GFile(cache_path, 'rb') as f:
+      df = pickle.load(f)
+  except (EOFError, pickle.UnpicklingError, AttributeError, ImportError,
+          TypeError, ValueError, tf.errors.OpError) as e:
+    # The file is rebuilt from the TSV files and overwritten.
+    logging.warning('Ignoring unreadable cache file %s: %s', cache_path, e)
+    return None
+  if not isinstance(df, pd.DataFrame):
+    logging.warning('Ignoring cache file %s, which holds a %s.', cache_path,
+                    type(df).__name__)
+    return None
+  return df
+
+
+def _write_cache(df: pd.DataFrame, cache_path: str) -> None:
+  """Writes df to cache_path, which readers never see partially written."""
+  tf.io.gfile.makedirs(os.path.dirname(cache_path))
+  tmp_path = f'{cache_path}.tmp-{uuid.uuid4().hex}'
+  with tf.io.gfile.GFile(tmp_path, 'wb') as f:
+    pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+  tf.io.gfile.rename(tmp_path, cache_path, overwrite=True)
+
+
+def read_sharded_runtime_tsvs(path_string: str,
+                              cache_dir: Optional[str] = None) -> pd.DataFrame:
   """Imports data from a single or sharded path into a pandas dataframe.
 
+  Shards are read concurrently, which mostly helps hide the latency of
+  reading many shards from GCS.
+
   Args:
     path_string: The path to the input file, which may be sharded.
+    cache_dir: Optional directory in which to cache the parsed dataframe,
+      keyed by the path, modification time, and size of every input file. The
+      cache is a pickle, so this must be a private, trusted directory.
 
   Returns:
     A dataframe matching the TSV file(s) but with added Task column.
@@ -91,19 +171,23 @@ def read_sharded_runtime_tsvs(path_string: str) -> pd.DataFrame:
     paths = sharded_file_utils.generate_sharded_filenames(path_string)
   else:
     paths = [path_string]
-  list_of_dataframes = []
-  for i, path in enumerate(paths):
-    if path.startswith('gs://'):
-      # Once pandas is updated to 0.24+, pd.read_csv will work for gs://
-      # without this workaround.
-      with tf.io.gfile.GFile(path) as f:
-        d = pd.read_csv(f, sep='\t')
-    else:
-      d = pd.read_csv(path, sep='\t')
-    d['Task'] = i
-    list_of_dataframes.append(d)
-
-  return pd.concat(list_of_dataframes, axis=0, ignore_index=True)
+  if cache_dir:
+    cache_path = _cache_path(paths, cache_dir)
+    cached_df = _read_cache(cache_path)
+    if cached_df is not None:
+      return cached_df
+  with concurrent.futures.ThreadPoolExecutor() as executor:
+    # executor.map returns results in the same order as paths.
+    list_of_dataframes = list(executor.map(_read_runtime_tsv, paths))
+  df = pd.concat(list_of_dataframes, axis=0, ignore_index=True, copy=False)
+  # Each shard is one task, so Task is the shard index repeated once for each
+  # row of that shard.
+  df['Task'] = np.repeat(
+      np.arange(len(list_of_dataframes), dtype=np.int32),
+      [len(d) for d in list_of_dataframes])
+  if cache_dir:
+    _write_cache(df, cache_path)
+  return df
 
 
 def format_runtime_string(raw_seconds: float) -> str:
@@ -129,6 +213,33 @@ def format_runtime_string(raw_seconds: float) -> str:
   return output
 
 
+def format_runtime_strings(raw_seconds: pd.Series) -> pd.Series:
+  """Formats a whole series of seconds like format_runtime_string does.
+
+  Args:
+    raw_seconds: A series of numbers of seconds.
+
+  Returns:
+    A series of formatted strings with the same index as raw_seconds.
+  """
+  minutes, seconds = np.divmod(raw_seconds.to_numpy(dtype=np.float64), 60)
+  hours, minutes = np.divmod(minutes, 60)
+  # np.round scales by 1000 and rounds half to even, which differs from
+  # Python's correctly rounded round() on half-way values such as 0.0005, so
+  # the seconds are rounded the same way format_runtime_string does.
+  seconds = np.array([round(s, 3) for s in seconds.tolist()], dtype=np.float64)
+  output = np.char.add(
+      np.where(hours > 0, np.char.add(hours.astype(np.int64).astype(str), 'h'),
+               ''),
+      np.where(minutes > 0,
+               np.char.add(minutes.astype(np.int64).astype(str), 'm'), ''))
+  show_seconds = (seconds > 0) | (np.char.str_len(output) == 0)
+  output = np.char.add(
+      output,
+      np.where(show_seconds, np.char.add(seconds.astype(str), 's'), ''))
+  return pd.Series(output, index=raw_seconds.index, dtype=object)
+
+
 def calculate_totals(df: pd.DataFrame) -> pd.DataFrame:
   """Calculates total runtime, formats it nicely, and sorts by it.
 
@@ -142,7 +253,7 @@ def calculate_totals(df: pd.DataFrame) -> pd.DataFrame:
   df['total runtime'] = df[RUNTIME_COLUMNS].sum(axis=1)
 
   # Create a formatted runtime string for tooltips.
-  df['Runtime'] = df['total runtime'].apply(format_runtime_string)
+  df['Runtime'] = format_runtime_strings(df['total runtime'])
 
   # Sort by descending total region runtime.
   df.sort_values(by='total runtime', inplace=True, ascending=False)
@@ -219,13 +330,13 @@ def totals_by_stage(d: pd.DataFrame) -> alt.Chart:
   Returns:
     An altair chart.
   """
-  stage_totals_series = d.sum()[RUNTIME_COLUMNS]
+  stage_totals_series = d[RUNTIME_COLUMNS].sum()
   stage_totals = pd.DataFrame(
       stage_totals_series, columns=['Runtime (seconds)'])
   stage_totals.reset_index(inplace=True)
   stage_totals = stage_totals.rename(columns={'index': 'Stage'})
-  stage_totals['Runtime'] = stage_totals['Runtime (seconds)'].apply(
-      format_runtime_string)
+  stage_totals['Runtime'] = format_runtime_strings(
+      stage_totals['Runtime (seconds)'])
   return alt.Chart(stage_totals).mark_bar().encode(
       x='Runtime (seconds)',
       y=alt.Y('Stage', sort=None),
@@ -234,42 +345,36 @@ def totals_by_stage(d: pd.DataFrame) -> alt.Chart:
                     sort=None)).properties(title='Overall runtime by stage')
 
 
-def pareto_by_task_tooltip(row: pd.Series) -> str:
-  """For one row of a dataframe, computes a tooltip description.
-
-  Args:
-    row: A Pandas Series, one row of a dataframe containing some specific
-      cumulative sum columns.
-
-  Returns:
-    A string to show as the tooltip for a pareto curve.
-  """
-  return (f"{row['task cumsum order'] * 100:.2f}% of regions "
-          f"account for {row['task cumsum fraction'] * 100:.2f}% of "
-          f"the runtime in task {row['Task']}")
-
-
-def calculate_pareto_metrics(df_subset: pd.DataFrame) -> pd.DataFrame:
-  """Calculates cumulative sums for a subset of a dataframe.
+def calculate_pareto_metrics(df: pd.DataFrame) -> pd.DataFrame:
+  """Calculates per-task totals and cumulative sums for all regions.
 
   Args:
-    df_subset: A dataframe subset of one task.
+    df: A dataframe of all regions, sorted by descending total runtime.
 
   Returns:
-    The same dataframe subset with some additional columns.
+    A new dataframe with the same index, holding the Task and total runtime
+        columns plus the per-task pareto columns.
   """
+  pareto = df[['Task', 'total runtime', 'num examples']].copy()
+  by_task = pareto.groupby('Task', sort=False)
+  runtime_by_task = by_task['total runtime']
   # These are the same for all regions in the same task, for the scatter plot:
-  df_subset['task total runtime'] = df_subset['total runtime'].sum()
-  df_subset['Runtime for task'] = df_subset['task total runtime'].apply(
-      format_runtime_string)
-  df_subset['task num examples'] = df_subset['num examples'].sum()
+  pareto['task total runtime'] = runtime_by_task.transform('sum')
+  pareto['Runtime for task'] = format_runtime_strings(
+      pareto['task total runtime'])
+  pareto['task num examples'] = by_task['num examples'].transform('sum')
   # These are cumulative sums for the pareto curves:
-  df_subset['task cumsum fraction'] = df_subset['total runtime'].cumsum(
-  ) / df_subset['total runtime'].sum()
-  n = len(df_subset)
-  df_subset['task cumsum order'] = list(map(lambda x: x / n, range(0, n)))
-  df_subset['tooltip'] = df_subset.apply(pareto_by_task_tooltip, axis=1)
-  return df_subset
+  pareto['task cumsum fraction'] = runtime_by_task.cumsum(
+  ) / pareto['task total runtime']
+  pareto['task cumsum order'] = by_task.cumcount() / runtime_by_task.transform(
+      'size')
+  # Build the pareto curve tooltips column-wise rather than row by row.
+  pareto['tooltip'] = (
+      (pareto['task cumsum order'] * 100).map('{:.2f}'.format) +
+      '% of regions account for ' +
+      (pareto['task cumsum fraction'] * 100).map('{:.2f}'.format) +
+      '% of the runtime in task ' + pareto['Task'].astype(str))
+  return pareto
 
 
 def pareto_and_runtimes_by_task(df: pd.DataFrame) -> alt.Chart:
@@ -286,8 +391,7 @@ def pareto_and_runtimes_by_task(df: pd.DataFrame) -> alt.Chart:
   Returns:
     An altair chart.
   """
-  grouped = df.groupby(df['Task'], sort=False)
-  df = grouped.apply(calculate_pareto_metrics)
+  df = calculate_pareto_metrics(df)
 
   # Sample along the Pareto curve, ensuring the longest regions are shown.
   if len(df) > 5000:
@@ -374,11 +478,14 @@ def selected_longest_and_median_regions(df: pd.DataFrame) -> alt.Chart:
   | individual_region_bars(df.iloc[mid-10:mid+11], 'Median runtime regions')
 
 
-def top_regions_producing_zero_examples(df: pd.DataFrame) -> alt.Chart:
+def top_regions_producing_zero_examples(
+    df: pd.DataFrame, total_runtime: Optional[float] = None) -> alt.Chart:
   """Creates a chart of the top regions that produced zero examples.
 
   Args:
     df: A dataframe of all regions.
+    total_runtime: The total runtime of all regions in seconds, if already
+      known. Otherwise it is computed from df.
 
   Returns:
     An altair chart.
@@ -387,7 +494,9 @@ def top_regions_producing_zero_examples(df: pd.DataFrame) -> alt.Chart:
 
   runtime_of_zeros = regions_with_zero_examples['total runtime'].sum() / 3600
 
-  total_runtime = df['total runtime'].sum() / 3600
+  if total_runtime is None:
+    total_runtime = df['total runtime'].sum()
+  total_runtime /= 3600
   subtitle = (
       f'Spent {runtime_of_zeros:.2f} hours processing the '
       f'{len(regions_with_zero_examples)} regions that produced no examples, '
@@ -403,17 +512,19 @@ def top_regions_producing_zero_examples(df: pd.DataFrame) -> alt.Chart:
 
 
 def read_data_and_make_dataframes(
-    input_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    input_path: str,
+    cache_dir: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
   """Loads data from a file into one dataframe as-is and one by task.
 
   Args:
     input_path: str, path of the input TSV file (may be sharded).
+    cache_dir: Optional directory for caching the parsed input.
 
   Returns:
     df: A dataframe with one row per region.
     by_task: A dataframe with one row per task.
   """
-  df = read_sharded_runtime_tsvs(input_path)
+  df = read_sharded_runtime_tsvs(input_path, cache_dir=cache_dir)
   df = calculate_totals(df)
   by_task = summarize_by_task(df)
   return df, by_task
@@ -425,7 +536,8 @@ def make_all_charts(
   """Creates charts and puts them in a list with their ID names.
 
   Args:
-    df: A dataframe with one row per region.
+    df: A dataframe with one row per region, sorted by descending total
+      runtime as done by calculate_totals.
     by_task: A dataframe with one row per task.
 
   Returns:
@@ -445,7 +557,9 @@ def make_all_charts(
       'chart': selected_longest_and_median_regions(df)
   }, {
       'id': 'zero_examples',
-      'chart': top_regions_producing_zero_examples(df)
+      'chart':
+          top_regions_producing_zero_examples(
+              df, total_runtime=by_task['total runtime'].sum())
   }]
 
   # Altair shows a max of 5000 data points.
@@ -460,11 +574,12 @@ def make_all_charts(
     }])
   else:
     # With too many points, make different subsets to show trends better.
-    top_100 = df.nlargest(100, 'total runtime')
-    top_5000 = df.nlargest(5000, 'total runtime')
+    # Since df is already sorted by total runtime, these are just slices.
+    top_100 = df.iloc[:100]
+    top_5000 = df.iloc[:5000]
 
     # Sample the bottom 99% to avoid outliers that obscure general trends.
-    bottom_99_percent = df.nsmallest(int(len(df) * .99), 'total runtime')
+    bottom_99_percent = df.iloc[len(df) - int(len(df) * .99):]
     if len(bottom_99_percent) > 5000:
       bottom_99_percent = bottom_99_percent.sample(5000)
 
@@ -497,18 +612,21 @@ def make_all_charts(
   return charts
 
 
-def make_report(input_path: str, title: str,
-                html_output: tf.io.gfile.GFile) -> None:
+def make_report(input_path: str,
+                title: str,
+                html_output: tf.io.gfile.GFile,
+                cache_dir: Optional[str] = None) -> None:
   """Reads data, creates charts, and composes the charts into an HTML report.
 
   Args:
     input_path: Path of the input TSV file (or sharded files).
     title: Title to put at the top of the report.
     html_output: Writable file object where output will be written.
+    cache_dir: Optional directory for caching the parsed input.
   """
 
   # Load data into pandas dataframes and add summary columns.
-  df, by_task = read_data_and_make_dataframes(input_path)
+  df, by_task = read_data_and_make_dataframes(input_path, cache_dir=cache_dir)
 
   # Build all the charts.
   charts = make_all_charts(df, by_task)
@@ -538,7 +656,10 @@ def main(argv: Sequence[str]):
   # Start HTML document. Using GFile enables writing to GCS too.
   html_output = tf.io.gfile.GFile(output_filename, 'w')
   make_report(
-      input_path=FLAGS.input, title=FLAGS.title, html_output=html_output)
+      input_path=FLAGS.input,
+      title=FLAGS.title,
+      html_output=html_output,
+      cache_dir=FLAGS.cache_dir)
   html_output.close()  # Abstracted out the file open/close to enable testing.
   print('Output written to:', output_filename)
 
@@ -29,9 +29,12 @@
 """Tests for DeepVariant runtime_by_region_vis visual report script."""
 
 import io
+import os
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import mock
+import numpy as np
 import pandas as pd
 
 from deepvariant import runtime_by_region_vis
@@ -116,6 +119,19 @@ class RuntimeByRegionVisTest(parameterized.TestCase):
     self.assertEqual(expected,
                      runtime_by_region_vis.format_runtime_string(raw_seconds))
 
+  def test_format_runtime_strings(self):
+    # Includes half-way values, where np.round and round() disagree.
+    values = [
+        5.0, 3600.0, 62.0, 3661.5, 0.0001, 0.001, 0.73, 0.0005, 59.9995,
+        0.0015, 2.6785, 3659.9995
+    ]
+    raw_seconds = pd.Series(values, index=list(reversed(range(len(values)))))
+    formatted = runtime_by_region_vis.format_runtime_strings(raw_seconds)
+    self.assertEqual(list(formatted.index), list(raw_seconds.index))
+    self.assertEqual(
+        list(formatted),
+        [runtime_by_region_vis.format_runtime_string(s) for s in raw_seconds])
+
   def test_read_data_and_make_dataframes(self):
     input_path = testdata.RUNTIME_BY_REGION
     df, by_task = runtime_by_region_vis.read_data_and_make_dataframes(
@@ -124,6 +140,73 @@ class RuntimeByRegionVisTest(parameterized.TestCase):
     self.assertEqual(df.to_json(), JSON_DF)
     self.assertEqual(by_task.to_json(), JSON_BY_TASK_DF)
 
+  def test_read_sharded_runtime_tsvs_task_per_shard(self):
+    tmp_dir = self.create_tempdir()
+    header = '\t'.join(['region'] + runtime_by_region_vis.RUNTIME_COLUMNS +
+                       runtime_by_region_vis.COUNT_COLUMNS)
+    # Shards of different lengths, with each region named after its shard.
+    shard_lengths = [3, 1, 2]
+    for shard, length in enumerate(shard_lengths):
+      rows = [
+          f'{shard}:{i}-{i}\t0.1\t0.2\t0.3\t0.4\t5\t6\t7'
+          for i in range(length)
+      ]
+      tmp_dir.create_file(
+          f'foo-{shard:05d}-of-00003.tsv', content='\n'.join([header] + rows))
+    df = runtime_by_region_vis.read_sharded_runtime_tsvs(
+        os.path.join(tmp_dir.full_path, 'foo@3.tsv'))
+    self.assertEqual(df['Task'].dtype, np.int32)
+    self.assertEqual(list(df['Task']), [0, 0, 0, 1, 2, 2])
+    self.assertEqual(
+        list(df['Task']), [int(r.split(':')[0]) for r in df['region']])
+
+  def test_read_sharded_runtime_tsvs_with_cache(self):
+    cache_dir = self.create_tempdir().full_path
+    df = runtime_by_region_vis.read_sharded_runtime_tsvs(
+        testdata.RUNTIME_BY_REGION, cache_dir=cache_dir)
+    self.assertLen(os.listdir(cache_dir), 1)
+    with mock.patch.object(runtime_by_region_vis,
+                           '_read_runtime_tsv') as mock_read:
+      cached_df = runtime_by_region_vis.read_sharded_runtime_tsvs(
+          testdata.RUNTIME_BY_REGION, cache_dir=cache_dir)
+    mock_read.assert_not_called()
+    pd.testing.assert_frame_equal(df, cached_df)
+
+  def test_read_sharded_runtime_tsvs_rebuilds_unreadable_cache(self):
+    cache_dir = self.create_tempdir().full_path
+    df = runtime_by_region_vis.read_sharded_runtime_tsvs(
+        testdata.RUNTIME_BY_REGION, cache_dir=cache_dir)
+    [cache_file] = os.listdir(cache_dir)
+    cache_path = os.path.join(cache_dir, cache_file)
+    # Simulate a truncated cache file.
+    with open(cache_path, 'rb') as f:
+      truncated = f.read()[:10]
+    with open(cache_path, 'wb') as f:
+      f.write(truncated)
+
+    rebuilt_df = runtime_by_region_vis.read_sharded_runtime_tsvs(
+        testdata.RUNTIME_BY_REGION, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(df, rebuilt_df)
+    # The cache was overwritten with a readable file, and no temporary files
+    # are left behind.
+    self.assertEqual(os.listdir(cache_dir), [cache_file])
+    with mock.patch.object(runtime_by_region_vis,
+                           '_read_runtime_tsv') as mock_read:
+      cached_df = runtime_by_region_vis.read_sharded_runtime_tsvs(
+          testdata.RUNTIME_BY_REGION, cache_dir=cache_dir)
+    mock_read.assert_not_called()
+    pd.testing.assert_frame_equal(df, cached_df)
+
+  def test_cache_path_depends_on_format_version(self):
+    paths = [testdata.RUNTIME_BY_REGION]
+    cache_path = runtime_by_region_vis._cache_path(paths, '/cache')
+    self.assertEqual(
+        cache_path, runtime_by_region_vis._cache_path(paths, '/cache'))
+    with mock.patch.object(runtime_by_region_vis, '_CACHE_FORMAT_VERSION',
+                           runtime_by_region_vis._CACHE_FORMAT_VERSION + 1):
+      self.assertNotEqual(
+          cache_path, runtime_by_region_vis._cache_path(paths, '/cache'))
+
   def test_chart_type_negative_control(self):
     self.assertFalse(is_an_altair_chart('some string'))
     self.assertFalse(is_an_altair_chart(None))
@@ -138,6 +221,26 @@ class RuntimeByRegionVisTest(parameterized.TestCase):
     chart = runtime_by_region_vis.pareto_and_runtimes_by_task(df)
     self.assertTrue(is_an_altair_chart(chart))
 
+  def test_calculate_pareto_metrics(self):
+    df = pd.DataFrame({
+        'Task': [1, 0, 1, 0, 0],
+        'total runtime': [6.0, 5.0, 2.0, 3.0, 2.0],
+        'num examples': [1, 2, 3, 4, 5],
+    })
+    pareto = runtime_by_region_vis.calculate_pareto_metrics(df)
+    self.assertEqual(list(pareto.index), list(df.index))
+    self.assertEqual(list(pareto['task total runtime']), [8, 10, 8, 10, 10])
+    self.assertEqual(list(pareto['task num examples']), [4, 11, 4, 11, 11])
+    self.assertEqual(
+        list(pareto['task cumsum fraction']), [0.75, 0.5, 1.0, 0.8, 1.0])
+    self.assertEqual(
+        list(pareto['task cumsum order']), [0, 0, 0.5, 1 / 3, 2 / 3])
+    self.assertEqual(
+        pareto['tooltip'][3],
+        '33.33% of regions account for 80.00% of the runtime in task 0')
+    self.assertEqual(pareto['Runtime for task'][0], '8.0s')
+    self.assertNotIn('task total runtime', df.columns)
+
   @parameterized.parameters(
       dict(dataframe_json=JSON_BY_TASK_DF, msg='Histogram of tasks'),
       dict(dataframe_json=JSON_DF, msg='Histogram of regions'),